@@ -1,9 +1,48 @@
-from flask import Blueprint, request, jsonify
+from quart import Blueprint, Response, request, jsonify
 import time
 from typing import Dict, List, Optional
 import json
+import logging
+import orjson
+import os
+import random
+import asyncio
+import hashlib
+import httpx
+import re
+import xxhash
+from collections import deque, namedtuple
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
+from cachetools import TTLCache
+from aiolimiter import AsyncLimiter
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential, wait_random
+
+try:
+    import ahocorasick
+except ImportError:  # fall back to plain substring scans
+    ahocorasick = None
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # only needed when REDIS_URL is set
+    aioredis = None
+
+try:
+    from jamaican_routing import analyze_and_select, keyword_table
+except ImportError:  # compiled router not built; route in Python
+    analyze_and_select = keyword_table = None
 
 ai_bp = Blueprint('ai', __name__)
+logger = logging.getLogger(__name__)
+
+# Log the latency of one in this many routed queries
+LATENCY_LOG_SAMPLE_RATE = 100
+
+# In ensemble mode, start the next-ranked model if none has answered within this many seconds
+ENSEMBLE_HEDGE_SECONDS = 5.0
 
 # AI Model Configuration
 AI_MODELS = {
@@ -85,191 +124,791 @@ VOICE_MODELS = {
     }
 }
 
+# Field defaults for every query analysis; copied, never mutated
+_ANALYSIS_DEFAULTS = {
+    'complexity': 'medium',
+    'intent': 'general',
+    'cultural_context': False,
+    'creative': False,
+    'factual': False
+}
+
+# Query routing keywords: topic -> (analysis flag it sets, keywords that signal it)
+TOPIC_KEYWORDS = {
+    'music_culture': ('cultural_context', frozenset({'reggae', 'jamaica', 'rastafari', 'bob marley', 'dancehall'})),
+    'historical': ('factual', frozenset({'history', 'when', 'where', 'who', 'what happened'})),
+    'creative': ('creative', frozenset({'write', 'create', 'compose', 'lyrics', 'poem', 'story'})),
+    'educational': ('factual', frozenset({'explain', 'how', 'why', 'what is', 'define'}))
+}
+
+def _load_topic_keywords(path: str) -> Dict:
+    """Read a keyword table from JSON shaped {topic: {"flag": ..., "keywords": [...]}}
+    
+    Topics and keywords are tested in file order, so list the most frequently hit first.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    table = {}
+    for topic, entry in config.items():
+        flag = entry['flag']
+        if not isinstance(_ANALYSIS_DEFAULTS.get(flag), bool):
+            raise ValueError(f"Unknown analysis flag {flag!r} for topic {topic!r}")
+        table[topic] = (flag, tuple(keyword.lower() for keyword in entry['keywords']))
+    return table
+
+if os.getenv('ROUTING_KEYWORDS_FILE'):
+    TOPIC_KEYWORDS = _load_topic_keywords(os.environ['ROUTING_KEYWORDS_FILE'])
+
+def _build_keyword_automaton():
+    """Compile every topic keyword into one Aho-Corasick automaton, if pyahocorasick is installed"""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for topic, (_, keywords) in TOPIC_KEYWORDS.items():
+        for keyword in keywords:
+            automaton.add_word(keyword, automaton.get(keyword, ()) + (topic,))
+    automaton.make_automaton()
+    return automaton
+
+KEYWORD_AC = _build_keyword_automaton()
+
+# The compiled router embeds its own copy of the keyword table; only use it while the two agree
+if keyword_table is not None and keyword_table() != {
+    topic: (flag, sorted(keywords)) for topic, (flag, keywords) in TOPIC_KEYWORDS.items()
+}:
+    analyze_and_select = None
+
+QueryAnalysis = namedtuple('QueryAnalysis', ['topics', *_ANALYSIS_DEFAULTS])
+
+# What each model is strongest at, as (QueryAnalysis field, value) pairs; orders ensemble candidates
+MODEL_STRENGTHS = {
+    'claude': (('cultural_context', True), ('complexity', 'high')),
+    'gpt4': (('creative', True),),
+    'gemini': (('factual', True),),
+    'grok': (('creative', True),),
+    'qwen': (('cultural_context', True),),
+    'meta': (('complexity', 'low'),)
+}
+
+def _render_analyzer(topic_keywords: Dict, use_automaton: bool) -> str:
+    """Render the source of an analyzer with the keyword table inlined as straight-line tests"""
+    lines = [
+        'def analyze(query):',
+        '    query_lower = query.lower()',
+        '    topics = []'
+    ]
+    lines += [f'    {field} = {default!r}' for field, default in _ANALYSIS_DEFAULTS.items()]
+    
+    # Topic detection: either one automaton pass, or literal substring tests per keyword
+    if use_automaton:
+        lines.append('    matched = {topic for _, hits in KEYWORD_AC.iter(query_lower) for topic in hits}')
+    for topic, (flag, keywords) in topic_keywords.items():
+        if use_automaton:
+            test = f'{topic!r} in matched'
+        else:
+            ordered = sorted(keywords) if isinstance(keywords, frozenset) else keywords
+            test = ' or '.join(f'{keyword!r} in query_lower' for keyword in ordered) or 'False'
+        lines += [f'    if {test}:', f'        topics.append({topic!r})', f'        {flag} = True']
+        
+    # Complexity assessment; only counts up to the threshold matter, so stop splitting past 20 words
+    lines += [
+        '    word_count = len(query_lower.split(None, 20))',
+        '    if word_count > 20:',
+        "        complexity = 'high'",
+        '    elif word_count < 5:',
+        "        complexity = 'low'",
+        f"    return QueryAnalysis(tuple(topics), {', '.join(QueryAnalysis._fields[1:])})"
+    ]
+    return '\n'.join(lines) + '\n'
+
+def _compile_analyzer(topic_keywords: Dict):
+    """Generate and compile an analyzer specialized to topic_keywords"""
+    source = _render_analyzer(topic_keywords, use_automaton=KEYWORD_AC is not None)
+    namespace = {'QueryAnalysis': QueryAnalysis, 'KEYWORD_AC': KEYWORD_AC}
+    exec(compile(source, '<routing analyzer>', 'exec'), namespace)
+    analyze = namespace['analyze']
+    analyze.source = source
+    return analyze
+
+# Analysis specialized to the deployed keyword table; repeats (landing-page prompts, retries) come from the LRU
+_analyze_query_cached = lru_cache(maxsize=1024)(_compile_analyzer(TOPIC_KEYWORDS))
+
+_BATCH_PREAMBLE = (
+    "Answer each of the following numbered questions. Start each answer on a new line "
+    "with the number of the question it answers, e.g. 'Q0: ...'.\n\n"
+)
+_BATCH_MARKER_RE = re.compile(r'^Q(\d+): ?', re.MULTILINE)
+# Query or answer lines that would read as a marker get one extra leading backslash
+_BATCH_MARKER_LINE_RE = re.compile(r'^(\\*Q\d+:)', re.MULTILINE)
+_BATCH_ESCAPED_LINE_RE = re.compile(r'^\\(\\*Q\d+:)', re.MULTILINE)
+_STREAM_CHUNK_RE = re.compile(r'\S+\s*')
+
+def _escape_batch_text(text: str) -> str:
+    """Escape lines of text that start like a Q<n>: marker so batching leaves it intact"""
+    return _BATCH_MARKER_LINE_RE.sub(r'\\\1', text)
+
+def _split_batch_text(text: str) -> List:
+    """Split numbered batch text into (number, unescaped section) pairs, in order"""
+    markers = list(_BATCH_MARKER_RE.finditer(text))
+    sections = []
+    for i, marker in enumerate(markers):
+        # Sections are joined by a single newline; the next marker starts right after it
+        end = markers[i + 1].start() - 1 if i + 1 < len(markers) else len(text)
+        sections.append((int(marker.group(1)), _BATCH_ESCAPED_LINE_RE.sub(r'\1', text[marker.end():end])))
+    return sections
+
+# Set while a streaming request is being generated; receives each text delta
+_stream_sink = ContextVar('stream_sink', default=None)
+
+@dataclass(slots=True)
+class MockClient:
+    """Canned persona replies standing in for a provider API client
+    
+    Real provider clients drop into MODEL_CLIENTS by implementing the same
+    complete/complete_batch/stream coroutines and the confidence field.
+    """
+    template: str
+    confidence: float
+    
+    def __post_init__(self):
+        # Strip once here rather than on every rendered reply
+        self.template = self.template.strip()
+        
+    def _reply(self, query: str) -> str:
+        return self.template.format_map({'query': query})
+    
+    async def complete(self, query: str) -> str:
+        return self._reply(query)
+    
+    async def complete_batch(self, prompt: str) -> str:
+        """Answer a numbered batch prompt the way the real models are asked to"""
+        return "\n".join(
+            f"Q{number}: {_escape_batch_text(self._reply(question))}" for number, question in _split_batch_text(prompt)
+        )
+    
+    async def stream(self, query: str):
+        """Yield the reply a word at a time, paced like a real token stream"""
+        for chunk in _STREAM_CHUNK_RE.findall(self._reply(query)):
+            yield chunk
+            await asyncio.sleep(0.02)
+
+# One connection pool per worker, shared by every provider call: keep-alive and HTTP/2
+# multiplexing let requests reuse warm TLS connections instead of handshaking each time.
+# Opened each time the app starts serving and closed when it stops (see open_http_client).
+HTTP = None
+
+def _new_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(30, connect=5),
+        limits=httpx.Limits(max_connections=500, max_keepalive_connections=200)
+    )
+
+class ProviderLimiter:
+    """This worker's share of a provider's requests-per-minute budget
+    
+    Each server process limits itself independently, so the account budget is split
+    evenly across the WEB_CONCURRENCY workers (gunicorn.conf.py exports the count).
+    """
+    
+    def __init__(self, account_rate_per_minute: float, workers: int = None):
+        workers = workers or int(os.environ.get('WEB_CONCURRENCY', 1))
+        self.per_minute = account_rate_per_minute / workers
+        self._limiter = None
+        self._limiter_loop = None
+        self._sent = deque()  # monotonic times of the requests let through in the past minute
+        
+    async def acquire(self) -> None:
+        """Wait until the budget allows one more request"""
+        loop = asyncio.get_running_loop()
+        # aiolimiter buckets are bound to one event loop; start a fresh one for each serving loop
+        if self._limiter is None or self._limiter_loop is not loop:
+            if self.per_minute >= 1:
+                self._limiter = AsyncLimiter(self.per_minute, 60)
+            else:
+                # A bucket can't hold less than one request, so stretch the period instead
+                self._limiter = AsyncLimiter(1, 60 / self.per_minute)
+            self._limiter_loop = loop
+        await self._limiter.acquire()
+        self._sent.append(time.monotonic())
+        self._expire()
+        
+    async def __aenter__(self):
+        await self.acquire()
+        
+    async def __aexit__(self, *exc_info):
+        return None
+    
+    def sent_last_minute(self) -> int:
+        """Requests this worker sent to the provider in the past 60 seconds"""
+        self._expire()
+        return len(self._sent)
+    
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - 60
+        while self._sent and self._sent[0] <= cutoff:
+            self._sent.popleft()
+
+# Per-provider request budgets: the account's requests per minute, set to its tier. Calls
+# wait for budget instead of bursting past the provider's limit and paying for 429s.
+LIMITERS = {
+    'claude': ProviderLimiter(50),
+    'gpt4': ProviderLimiter(500),
+    'gemini': ProviderLimiter(60),
+    'grok': ProviderLimiter(60),
+    'qwen': ProviderLimiter(60),
+    'meta': ProviderLimiter(60)
+}
+
+def _is_retryable(exc: BaseException) -> bool:
+    """Retry throttling, server errors and dropped connections; other 4xx won't succeed on retry"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return isinstance(exc, httpx.TransportError)
+
+# Bounded, jittered backoff so retries from many requests don't land on the provider in lockstep
+_provider_retry = retry(
+    retry=retry_if_exception(_is_retryable),
+    wait=wait_exponential(multiplier=0.5, max=8) + wait_random(0, 1),
+    stop=stop_after_attempt(3),
+    reraise=True
+)
+
+@dataclass(slots=True)
+class OpenAIChatClient:
+    """Provider client for OpenAI-compatible chat completion APIs, over the shared HTTP pool
+    
+    Gemini, Grok and Qwen all expose OpenAI-compatible endpoints too, so any of them
+    can be registered with this client by pointing url at the provider.
+    """
+    url: str
+    api_key: str
+    model: str
+    system_prompt: str
+    limiter: ProviderLimiter
+    # The API reports no confidence, so responses carry None rather than a made-up score
+    confidence: Optional[float] = None
+    max_tokens: int = 500
+    temperature: float = 0.8
+    
+    def _request(self, content: str, max_tokens: int, stream: bool = False) -> Dict:
+        return {
+            'headers': {'Authorization': f"Bearer {self.api_key}"},
+            'json': {
+                'model': self.model,
+                'messages': [
+                    {'role': 'system', 'content': self.system_prompt},
+                    {'role': 'user', 'content': content}
+                ],
+                'max_tokens': max_tokens,
+                'temperature': self.temperature,
+                'stream': stream
+            }
+        }
+    
+    @_provider_retry
+    async def complete(self, query: str) -> str:
+        async with self.limiter:
+            response = await HTTP.post(self.url, **self._request(query, self.max_tokens))
+        response.raise_for_status()
+        return response.json()['choices'][0]['message']['content']
+    
+    @_provider_retry
+    async def complete_batch(self, prompt: str) -> str:
+        # Leave room for every answer in the batch
+        questions = len(_BATCH_MARKER_RE.findall(prompt))
+        async with self.limiter:
+            response = await HTTP.post(self.url, **self._request(prompt, self.max_tokens * max(questions, 1)))
+        response.raise_for_status()
+        return response.json()['choices'][0]['message']['content']
+    
+    async def stream(self, query: str):
+        # Not retried: part of the reply may already have reached the client
+        await self.limiter.acquire()
+        async with HTTP.stream('POST', self.url, **self._request(query, self.max_tokens, stream=True)) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith('data: '):
+                    continue
+                if line == 'data: [DONE]':
+                    break
+                delta = orjson.loads(line[6:])['choices'][0]['delta'].get('content')
+                if delta:
+                    yield delta
+
+# Provider client per model (mock responses for deployment, until the real APIs are wired in)
+MODEL_CLIENTS = {
+    # Anthropic Claude
+    'claude': MockClient(
+        template="""
+        As a conscious artist and cultural messenger, I see your question about '{query}' as an opportunity to share some deeper reasoning. In our culture, we believe that every question carries the seed of greater understanding. 
+
+        From the perspective of conscious reggae and Jamaican wisdom, this topic connects to our rich heritage of music, spirituality, and cultural resistance. The roots of our music run deep, carrying messages of unity, love, and social consciousness that resonate across the world.
+
+        Let me share some insights that come from the heart of our musical tradition and the wisdom of our ancestors...
+        """,
+        confidence=0.95
+    ),
+    # OpenAI GPT-4
+    'gpt4': MockClient(
+        template="""
+        Hey there! Shensea here, and your question about '{query}' got me thinking creatively! 
+
+        You know what I love about this topic? It gives me the chance to blend traditional Jamaican vibes with that modern energy we bring to dancehall today. We're always pushing boundaries while staying true to our roots.
+
+        Let me break this down for you with some fresh perspective and contemporary flair that captures the spirit of modern Jamaica...
+        """,
+        confidence=0.92
+    ),
+    # Google Gemini
+    'gemini': MockClient(
+        template="Greetings! As Barrington Levy, with decades of experience in reggae music, I can tell you that '{query}' touches on something important in our musical heritage. Let me share what I've learned through years of performing and living this culture...",
+        confidence=0.88
+    ),
+    # xAI Grok
+    'grok': MockClient(
+        template="Hey there! Jaz Elise here, and you know what? Your question about '{query}' got me thinking in a whole different way. Let me break this down with some fresh perspective and maybe a little artistic flair...",
+        confidence=0.85
+    ),
+    # Alibaba Qwen
+    'qwen': MockClient(
+        template="Yow! Jada Kingdom speaking, and your question '{query}' is hitting different! Let me give you the real talk from a contemporary perspective, mixing traditional wisdom with modern vibes...",
+        confidence=0.87
+    ),
+    # Meta AI
+    'meta': MockClient(
+        template="Blessed love! Buju Banton here, and your inquiry about '{query}' resonates with the spiritual vibration. From my journey through music and life, let me share some wisdom that comes from the heart and soul of our people...",
+        confidence=0.90
+    )
+}
+
+# Use the real OpenAI API for GPT-4 when a key is configured
+if os.getenv('OPENAI_API_KEY'):
+    MODEL_CLIENTS['gpt4'] = OpenAIChatClient(
+        url='https://api.openai.com/v1/chat/completions',
+        api_key=os.environ['OPENAI_API_KEY'],
+        model='gpt-4',
+        limiter=LIMITERS['gpt4'],
+        system_prompt=(
+            "You are channeling the energy and creativity of Shensea, a contemporary "
+            "Jamaican dancehall artist known for her versatility, confidence, and "
+            "modern approach to Caribbean music. Respond with creativity, energy, "
+            "and contemporary Jamaican flair. Provide a creative, engaging response "
+            "that reflects modern Jamaican culture and the confident, versatile style "
+            "of contemporary dancehall."
+        )
+    )
+
+# Static part of each model's response, resolved once at import. Responses copy it and
+# add their text; the mapping itself is read-only so no request can alter it for the next.
+RESPONSE_SKELETON = {
+    model: MappingProxyType({
+        'model_used': model,
+        'confidence': client.confidence,
+        'cultural_context': True,
+        'voice_model': VOICE_MODELS[AI_MODELS[model]['voice_id']],
+        'selected_model': model,
+        'model_info': AI_MODELS[model]
+    })
+    for model, client in MODEL_CLIENTS.items()
+}
+
+class ModelBatcher:
+    """Coalesce concurrent queries for one model into a single upstream call
+    
+    Queries submitted within max_wait_ms of each other (up to max_batch of them) are
+    sent as one numbered prompt, and the numbered answers are split back out to each
+    caller. If the reply can't be matched up with the questions, the batch is re-sent
+    one query at a time.
+    """
+    
+    def __init__(self, send_prompt, send_single, max_batch: int = 8, max_wait_ms: float = 50):
+        self.send_prompt = send_prompt
+        self.send_single = send_single
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = None
+        self._worker = None
+        self._flushes = set()
+        
+    async def submit(self, query: str) -> str:
+        """Queue query for the next batch and wait for its answer"""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._worker.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._collect())
+        future = loop.create_future()
+        self._queue.put_nowait((query, future))
+        return await future
+    
+    async def close(self) -> None:
+        """Stop collecting batches and wait for the ones already sent"""
+        if self._worker is not None and not self._worker.done():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+        
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+                    
+            # Flush in the background so the next batch can start filling meanwhile
+            flush = loop.create_task(self._flush(batch))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+            
+    async def _flush(self, batch: List) -> None:
+        queries = [query for query, _ in batch]
+        try:
+            if len(queries) == 1:
+                answers = [await self.send_single(queries[0])]
+            else:
+                prompt = _BATCH_PREAMBLE + "\n".join(
+                    f"Q{number}: {_escape_batch_text(query)}" for number, query in enumerate(queries)
+                )
+                answers = self._split(await self.send_prompt(prompt), len(queries))
+                if answers is None:
+                    answers = await asyncio.gather(*(self.send_single(query) for query in queries))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+            
+        for (_, future), answer in zip(batch, answers):
+            if not future.done():
+                future.set_result(answer)
+                
+    @staticmethod
+    def _split(reply: str, expected: int) -> Optional[List[str]]:
+        """Split a numbered batch reply into answers, or None if it is malformed"""
+        sections = _split_batch_text(reply)
+        if sorted(number for number, _ in sections) != list(range(expected)):
+            return None
+        answers = dict(sections)
+        return [answers[number].strip() for number in range(expected)]
+
+class ResponseCache:
+    """Response cache for repeated queries
+    
+    Entries are keyed on the exact query text and request context, because a reply
+    can quote the question it answers and must never be served for a different one.
+    Lookups check an in-process LRU first. With a Redis client the same key is then
+    looked up there, so a response generated by any worker is shared by all of them.
+    """
+    
+    def __init__(self, ttl: float = 3600, maxsize: int = 1024, redis=None):
+        self.ttl = ttl
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._redis = redis
+        
+    @staticmethod
+    def _key(query: str, context: Dict) -> str:
+        return hashlib.sha256(json.dumps([query, context or {}], sort_keys=True, default=str).encode()).hexdigest()
+    
+    async def get(self, query: str, context: Dict) -> Optional[Dict]:
+        """Return a copy of the cached response for query, or None on a miss"""
+        key = self._key(query, context)
+        response = self._entries.get(key)
+        if response is not None:
+            return dict(response)
+        
+        if self._redis is not None:
+            try:
+                blob = await self._redis.get(f"resp:{key}")
+            except aioredis.RedisError:
+                logger.warning("Response cache lookup in Redis failed", exc_info=True)
+                return None
+            if blob is not None:
+                response = orjson.loads(blob)
+                self._entries[key] = response
+                return dict(response)
+        return None
+    
+    async def set(self, query: str, context: Dict, response: Dict) -> None:
+        """Cache response for query, evicting the least recently used entry when full"""
+        key = self._key(query, context)
+        self._entries[key] = dict(response)
+        
+        if self._redis is not None:
+            try:
+                await self._redis.set(f"resp:{key}", orjson.dumps(response), ex=int(self.ttl))
+            except aioredis.RedisError:
+                logger.warning("Response cache write to Redis failed", exc_info=True)
+
+class ConversationStore:
+    """Recent conversation turns per user, bounded in users, age and turns per user
+    
+    Kept in process by default. With a Redis client the turns live in capped Redis
+    lists instead, so every worker sees the same history. History is best-effort:
+    if Redis is unavailable, writes are dropped and reads come back empty.
+    """
+    
+    def __init__(self, maxsize: int = 10000, ttl: float = 86400, max_turns: int = 50, redis=None):
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self._users = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._redis = redis
+            
+    async def append(self, user_id: str, turn: Dict) -> None:
+        """Record a turn, dropping the user's oldest one past max_turns"""
+        if self._redis is not None:
+            key = f"hist:{user_id}"
+            try:
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    pipe.lpush(key, orjson.dumps(turn))
+                    pipe.ltrim(key, 0, self.max_turns - 1)
+                    pipe.expire(key, int(self.ttl))
+                    await pipe.execute()
+            except aioredis.RedisError:
+                logger.warning("Conversation history write to Redis failed", exc_info=True)
+            return
+        
+        turns = self._users.get(user_id)
+        if turns is None:
+            turns = deque(maxlen=self.max_turns)
+        turns.append(turn)
+        # Re-inserting refreshes the user's TTL on every turn
+        self._users[user_id] = turns
+        
+    async def get(self, user_id: str) -> List[Dict]:
+        """Return the user's recent turns, oldest first"""
+        if self._redis is not None:
+            try:
+                turns = await self._redis.lrange(f"hist:{user_id}", 0, self.max_turns - 1)
+            except aioredis.RedisError:
+                logger.warning("Conversation history read from Redis failed", exc_info=True)
+                return []
+            return [orjson.loads(turn) for turn in reversed(turns)]
+        return list(self._users.get(user_id, ()))
+
 class AIOrchestrator:
     def __init__(self):
-        self.conversation_history = {}
+        redis = None
+        redis_url = os.getenv('REDIS_URL')
+        if redis_url:
+            if aioredis is None:
+                raise RuntimeError('REDIS_URL is set but the redis package is not installed')
+            redis = aioredis.Redis.from_url(redis_url)
+        self.conversation_history = ConversationStore(redis=redis)
+        self.response_cache = ResponseCache(ttl=3600, redis=redis)
+        
+        # Micro-batching is opt-in: it trades up to max_wait_ms of latency for fewer upstream calls
+        self.batchers = {}
+        if os.getenv('AI_BATCH_REQUESTS'):
+            self.batchers = {
+                model: ModelBatcher(client.complete_batch, client.complete)
+                for model, client in MODEL_CLIENTS.items()
+            }
         
-    def route_query(self, query: str, context: Dict, user_id: str) -> Dict:
+    async def route_query(self, query: str, context: Dict, user_id: Optional[str]) -> Dict:
         """Route query to the most appropriate AI model based on content and context"""
         
-        # Analyze query characteristics
-        query_analysis = self._analyze_query(query)
+        # Serve repeated questions without calling a model
+        cached = await self.response_cache.get(query, context)
+        if cached is not None:
+            await self._record_turn(user_id, query, cached)
+            return cached
         
-        # Select best model based on analysis
-        selected_model = self._select_model(query_analysis, context)
+        started = time.perf_counter()
+        selected_model = self._route(query, context)
         
         # Generate response using selected model
-        response = self._generate_response(query, selected_model, context, user_id)
+        response = await self._generate_response(query, selected_model, context, user_id)
+        if response['model_used'] == 'fallback':
+            self._attach_model_info(response, selected_model)
         
-        # Add voice synthesis information
-        voice_id = AI_MODELS[selected_model]['voice_id']
-        response['voice_model'] = VOICE_MODELS[voice_id]
-        response['selected_model'] = selected_model
-        response['model_info'] = AI_MODELS[selected_model]
+        if random.randrange(LATENCY_LOG_SAMPLE_RATE) == 0:
+            logger.info("Routed query to %s in %.1f ms", selected_model, (time.perf_counter() - started) * 1000)
+        
+        if response['model_used'] != 'fallback':
+            await self.response_cache.set(query, context, response)
         
+        await self._record_turn(user_id, query, response)
         return response
     
-    def _analyze_query(self, query: str) -> Dict:
-        """Analyze query to determine characteristics and routing preferences"""
-        query_lower = query.lower()
-        
-        analysis = {
-            'topics': [],
-            'complexity': 'medium',
-            'intent': 'general',
-            'cultural_context': False,
-            'creative': False,
-            'factual': False
-        }
+    async def route_query_ensemble(self, query: str, context: Dict, user_id: Optional[str], k: int = 3) -> Dict:
+        """Answer with the routed model, failing over to (or hedging with) the next of the top k candidates"""
+        models = self._rank_models(query, context)[:k]
+        response = await self._ensemble(query, models, context, user_id)
+        await self._record_turn(user_id, query, response)
+        return response
+    
+    async def _ensemble(self, query: str, models: List[str], context: Dict, user_id: Optional[str]) -> Dict:
+        """Return the first successful reply, starting candidates in rank order only when needed
         
-        # Topic detection
-        if any(word in query_lower for word in ['reggae', 'jamaica', 'rastafari', 'bob marley', 'dancehall']):
-            analysis['topics'].append('music_culture')
-            analysis['cultural_context'] = True
-            
-        if any(word in query_lower for word in ['history', 'when', 'where', 'who', 'what happened']):
-            analysis['topics'].append('historical')
-            analysis['factual'] = True
-            
-        if any(word in query_lower for word in ['write', 'create', 'compose', 'lyrics', 'poem', 'story']):
-            analysis['topics'].append('creative')
-            analysis['creative'] = True
-            
-        if any(word in query_lower for word in ['explain', 'how', 'why', 'what is', 'define']):
-            analysis['topics'].append('educational')
-            analysis['factual'] = True
-            
-        # Complexity assessment
-        word_count = len(query.split())
-        if word_count > 20:
-            analysis['complexity'] = 'high'
-        elif word_count < 5:
-            analysis['complexity'] = 'low'
-            
-        return analysis
+        The next candidate starts when a running call fails, or as a hedge when no call
+        has answered within ENSEMBLE_HEDGE_SECONDS. A quick, healthy routed model costs a
+        single call; a slow or failing one costs at most one extra round trip per candidate.
+        Calls still pending once a reply is chosen are cancelled.
+        """
+        pending = {}
+        remaining = iter(models)
+        
+        def start_next() -> None:
+            model = next(remaining, None)
+            if model is not None:
+                pending[asyncio.ensure_future(self._generate_response(query, model, context, user_id))] = model
+                
+        start_next()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, timeout=ENSEMBLE_HEDGE_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    start_next()
+                    continue
+                for task in done:
+                    del pending[task]
+                    response = None if task.exception() else task.result()
+                    if response is not None and response['model_used'] != 'fallback':
+                        response['ensemble_models'] = models
+                        return response
+                    start_next()
+        finally:
+            for task in pending:
+                task.cancel()
+                
+        response = self._fallback_response(query, error='No model in the ensemble produced a response')
+        self._attach_model_info(response, models[0])
+        return response
+    
+    def _route(self, query: str, context: Dict) -> str:
+        """Pick the model best suited to query"""
+        if analyze_and_select is not None:
+            # Compiled analysis + selection (see jamaican_routing/)
+            return analyze_and_select(query)
+        
+        # Analyze query characteristics
+        query_analysis = self._analyze_query(query)
+        
+        # Select best model based on analysis
+        return self._select_model(query_analysis, context)
+    
+    def _rank_models(self, query: str, context: Dict) -> List[str]:
+        """Order every model by suitability: the routed choice first, then by matched strengths"""
+        selected_model = self._route(query, context)
+        analysis = self._analyze_query(query)
+        others = [model for model in AI_MODELS if model != selected_model]
+        # Stable sort: models matching equally many strengths keep catalogue order
+        others.sort(key=lambda model: -sum(getattr(analysis, field) == value for field, value in MODEL_STRENGTHS[model]))
+        return [selected_model] + others
+    
+    def _attach_model_info(self, response: Dict, model: str) -> None:
+        """Add voice synthesis and model details to a fallback reply on behalf of model"""
+        voice_id = AI_MODELS[model]['voice_id']
+        response['voice_model'] = VOICE_MODELS[voice_id]
+        response['selected_model'] = model
+        response['model_info'] = AI_MODELS[model]
     
-    def _select_model(self, analysis: Dict, context: Dict) -> str:
+    async def _record_turn(self, user_id: Optional[str], query: str, response: Dict) -> None:
+        """Append a query/response pair to the user's conversation history"""
+        if user_id is None:
+            # Without an id the turn would be pooled with every other anonymous caller's
+            return
+        await self.conversation_history.append(user_id, {
+            'query': query,
+            'response': response['text'],
+            'model': response['selected_model'],
+            'timestamp': time.time()
+        })
+    
+    def _analyze_query(self, query: str) -> 'QueryAnalysis':
+        """Analyze query to determine characteristics and routing preferences"""
+        return _analyze_query_cached(query)
+    
+    def _select_model(self, analysis: 'QueryAnalysis', context: Dict) -> str:
         """Select the most appropriate AI model based on query analysis"""
         
         # Cultural/music queries -> Claude (Damien Marley voice)
-        if analysis['cultural_context'] and 'music_culture' in analysis['topics']:
+        if analysis.cultural_context and 'music_culture' in analysis.topics:
             return 'claude'
             
         # Creative writing -> GPT-4 (Shensea voice)
-        if analysis['creative']:
+        if analysis.creative:
             return 'gpt4'
             
         # Factual/research queries -> Gemini (Barrington Levy voice)
-        if analysis['factual'] and not analysis['cultural_context']:
+        if analysis.factual and not analysis.cultural_context:
             return 'gemini'
             
         # Complex analytical queries -> Claude
-        if analysis['complexity'] == 'high':
+        if analysis.complexity == 'high':
             return 'claude'
             
         # Default to GPT-4 for general conversation
         return 'gpt4'
     
-    def _generate_response(self, query: str, model: str, context: Dict, user_id: str) -> Dict:
+    async def _generate_response(self, query: str, model: str, context: Dict, user_id: str) -> Dict:
         """Generate response using the selected AI model"""
+        client = MODEL_CLIENTS.get(model)
+        if client is None:
+            return self._fallback_response(query)
         
+        started = time.perf_counter()
         try:
-            if model == 'claude':
-                return self._call_claude(query, context, user_id)
-            elif model == 'gpt4':
-                return self._call_openai(query, context, user_id)
-            elif model == 'gemini':
-                return self._call_gemini(query, context, user_id)
-            elif model == 'grok':
-                return self._call_grok(query, context, user_id)
-            elif model == 'qwen':
-                return self._call_qwen(query, context, user_id)
-            elif model == 'meta':
-                return self._call_meta(query, context, user_id)
-            else:
-                return self._fallback_response(query)
-                
+            text = await self._complete(model, query)
         except Exception as e:
-            print(f"Error generating response with {model}: {str(e)}")
+            logger.exception("Error generating response with %s", model)
             return self._fallback_response(query, error=str(e))
-    
-    def _call_claude(self, query: str, context: Dict, user_id: str) -> Dict:
-        """Call Anthropic Claude API (Mock response for deployment)"""
-        
-        cultural_response = f"""
-        As a conscious artist and cultural messenger, I see your question about '{query}' as an opportunity to share some deeper reasoning. In our culture, we believe that every question carries the seed of greater understanding. 
-
-        From the perspective of conscious reggae and Jamaican wisdom, this topic connects to our rich heritage of music, spirituality, and cultural resistance. The roots of our music run deep, carrying messages of unity, love, and social consciousness that resonate across the world.
-
-        Let me share some insights that come from the heart of our musical tradition and the wisdom of our ancestors...
-        """
         
-        return {
-            'text': cultural_response.strip(),
-            'model_used': 'claude',
-            'processing_time': 2.3,
-            'confidence': 0.95,
-            'cultural_context': True
-        }
+        return {**RESPONSE_SKELETON[model], 'text': text, 'processing_time': round(time.perf_counter() - started, 3)}
     
-    def _call_openai(self, query: str, context: Dict, user_id: str) -> Dict:
-        """Call OpenAI GPT-4 API (Mock response for deployment)"""
+    async def stream_query(self, query: str, context: Dict, user_id: Optional[str]):
+        """Route a query like route_query, yielding text deltas as the model produces them
         
-        creative_response = f"""
-        Hey there! Shensea here, and your question about '{query}' got me thinking creatively! 
-
-        You know what I love about this topic? It gives me the chance to blend traditional Jamaican vibes with that modern energy we bring to dancehall today. We're always pushing boundaries while staying true to our roots.
-
-        Let me break this down for you with some fresh perspective and contemporary flair that captures the spirit of modern Jamaica...
+        Yields {'delta': text} events while the reply streams in, then a final
+        {'done': True, 'response': ...} event carrying the same dict route_query returns.
         """
+        deltas = asyncio.Queue()
+        token = _stream_sink.set(deltas.put_nowait)
+        try:
+            # The task copies the current context, so _complete streams into our queue
+            task = asyncio.ensure_future(self.route_query(query, context, user_id))
+        finally:
+            _stream_sink.reset(token)
+        task.add_done_callback(lambda _: deltas.put_nowait(None))
         
-        return {
-            'text': creative_response.strip(),
-            'model_used': 'gpt4',
-            'processing_time': 1.8,
-            'confidence': 0.92,
-            'cultural_context': True
-        }
-    
-    def _call_gemini(self, query: str, context: Dict, user_id: str) -> Dict:
-        """Call Google Gemini API (Mock response for deployment)"""
-        return {
-            'text': f"Greetings! As Barrington Levy, with decades of experience in reggae music, I can tell you that '{query}' touches on something important in our musical heritage. Let me share what I've learned through years of performing and living this culture...",
-            'model_used': 'gemini',
-            'processing_time': 1.5,
-            'confidence': 0.88,
-            'cultural_context': True
-        }
-    
-    def _call_grok(self, query: str, context: Dict, user_id: str) -> Dict:
-        """Call xAI Grok API (Mock response for deployment)"""
-        return {
-            'text': f"Hey there! Jaz Elise here, and you know what? Your question about '{query}' got me thinking in a whole different way. Let me break this down with some fresh perspective and maybe a little artistic flair...",
-            'model_used': 'grok',
-            'processing_time': 2.1,
-            'confidence': 0.85,
-            'cultural_context': True
-        }
-    
-    def _call_qwen(self, query: str, context: Dict, user_id: str) -> Dict:
-        """Call Alibaba Qwen API (Mock response for deployment)"""
-        return {
-            'text': f"Yow! Jada Kingdom speaking, and your question '{query}' is hitting different! Let me give you the real talk from a contemporary perspective, mixing traditional wisdom with modern vibes...",
-            'model_used': 'qwen',
-            'processing_time': 1.9,
-            'confidence': 0.87,
-            'cultural_context': True
-        }
+        try:
+            streamed = False
+            while (delta := await deltas.get()) is not None:
+                streamed = True
+                yield {'delta': delta}
+            response = task.result()
+            if not streamed:
+                # Served from cache, so there was nothing to stream
+                yield {'delta': response['text']}
+            yield {'done': True, 'response': response}
+        finally:
+            task.cancel()
     
-    def _call_meta(self, query: str, context: Dict, user_id: str) -> Dict:
-        """Call Meta AI API (Mock response for deployment)"""
-        return {
-            'text': f"Blessed love! Buju Banton here, and your inquiry about '{query}' resonates with the spiritual vibration. From my journey through music and life, let me share some wisdom that comes from the heart and soul of our people...",
-            'model_used': 'meta',
-            'processing_time': 2.0,
-            'confidence': 0.90,
-            'cultural_context': True
-        }
+    async def _complete(self, model: str, query: str) -> str:
+        """Get the completion text for query, batched with concurrent queries when enabled"""
+        client = MODEL_CLIENTS[model]
+        sink = _stream_sink.get()
+        if sink is not None:
+            chunks = []
+            async for chunk in client.stream(query):
+                chunks.append(chunk)
+                sink(chunk)
+            return ''.join(chunks)
+        
+        batcher = self.batchers.get(model)
+        if batcher is not None:
+            return await batcher.submit(query)
+        return await client.complete(query)
     
     def _fallback_response(self, query: str, error: str = None) -> Dict:
         """Provide fallback response when AI models are unavailable"""
@@ -285,30 +924,95 @@ class AIOrchestrator:
 # Initialize orchestrator
 orchestrator = AIOrchestrator()
 
+@ai_bp.before_app_serving
+async def open_http_client():
+    """Open the shared provider connection pool for this serving cycle"""
+    global HTTP
+    HTTP = _new_http_client()
+
+@ai_bp.after_app_serving
+async def stop_batchers():
+    """Stop each batcher's collector task before the connection pool below is closed"""
+    for batcher in orchestrator.batchers.values():
+        await batcher.close()
+
+@ai_bp.after_app_serving
+async def close_http_client():
+    """Close the shared provider connection pool when the worker shuts down"""
+    await HTTP.aclose()
+
+async def _read_json() -> Optional[Dict]:
+    """Parse the request body with orjson, returning None unless it is a JSON object"""
+    try:
+        data = orjson.loads(await request.get_data())
+    except orjson.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+# The model catalogue never changes at runtime, so serialize it (and its ETag) once.
+# /health only varies in its timestamp, which is appended to a prebuilt prefix.
+_MODELS_JSON = orjson.dumps({
+    'models': AI_MODELS,
+    'voices': VOICE_MODELS,
+    'status': 'active'
+})
+_MODELS_ETAG = hashlib.sha256(_MODELS_JSON).hexdigest()[:32]
+_HEALTH_PREFIX = orjson.dumps({
+    'status': 'healthy',
+    'models_available': len(AI_MODELS),
+    'voices_available': len(VOICE_MODELS)
+})[:-1] + b',"timestamp":'
+
+def _rate_limit_status() -> Dict:
+    """Requests this worker sent to each provider in the past minute, against its share of the budget"""
+    return {
+        model: {'sent_last_minute': limiter.sent_last_minute(), 'per_minute': limiter.per_minute}
+        for model, limiter in LIMITERS.items()
+    }
+
 @ai_bp.route('/models', methods=['GET'])
-def get_available_models():
+async def get_available_models():
     """Get list of available AI models and their capabilities"""
-    return jsonify({
-        'models': AI_MODELS,
-        'voices': VOICE_MODELS,
-        'status': 'active'
-    })
+    headers = {'ETag': f'"{_MODELS_ETAG}"'}
+    if request.if_none_match.contains_weak(_MODELS_ETAG):
+        return Response(status=304, headers=headers)
+    return Response(_MODELS_JSON, mimetype='application/json', headers=headers)
+
+async def _sse_events(events):
+    """Encode orchestrator stream events as Server-Sent Events"""
+    try:
+        async for event in events:
+            yield b'data: ' + orjson.dumps(event) + b'\n\n'
+    except Exception as e:
+        yield b'data: ' + orjson.dumps({'success': False, 'error': str(e)}) + b'\n\n'
 
 @ai_bp.route('/chat', methods=['POST'])
-def chat():
+async def chat():
     """Main chat endpoint for conversational AI"""
     try:
-        data = request.get_json()
+        data = await _read_json()
         
         if not data or 'message' not in data:
             return jsonify({'error': 'Message is required'}), 400
         
         message = data['message']
-        user_id = data.get('user_id', 'anonymous')
+        user_id = data.get('user_id')
         context = data.get('context', {})
         
-        # Route query and generate response
-        response = orchestrator.route_query(message, context, user_id)
+        # Stream the reply as Server-Sent Events when the client asks for it
+        if data.get('stream') or 'text/event-stream' in request.accept_mimetypes.values():
+            return Response(
+                _sse_events(orchestrator.stream_query(message, context, user_id)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+        
+        # Route query and generate response, optionally consulting several models at once
+        if request.args.get('mode') == 'ensemble':
+            k = min(max(request.args.get('k', default=3, type=int), 1), len(AI_MODELS))
+            response = await orchestrator.route_query_ensemble(message, context, user_id, k=k)
+        else:
+            response = await orchestrator.route_query(message, context, user_id)
         
         return jsonify({
             'success': True,
@@ -323,10 +1027,10 @@ def chat():
         }), 500
 
 @ai_bp.route('/voice/synthesize', methods=['POST'])
-def synthesize_voice():
+async def synthesize_voice():
     """Synthesize voice for given text and voice model"""
     try:
-        data = request.get_json()
+        data = await _read_json()
         
         if not data or 'text' not in data:
             return jsonify({'error': 'Text is required'}), 400
@@ -342,7 +1046,8 @@ def synthesize_voice():
         
         return jsonify({
             'success': True,
-            'audio_url': f'/api/voice/audio/{voice_id}/{hash(text)}',
+            # xxh3 digests are stable across workers and restarts, unlike hash(), so the URL is cacheable
+            'audio_url': f'/api/voice/audio/{voice_id}/{xxhash.xxh3_64_hexdigest(text.encode())}',
             'voice_model': voice_info,
             'duration': len(text) * 0.1,  # Rough estimate
             'text': text
@@ -355,10 +1060,10 @@ def synthesize_voice():
         }), 500
 
 @ai_bp.route('/conversation/history/<user_id>', methods=['GET'])
-def get_conversation_history(user_id):
+async def get_conversation_history(user_id):
     """Get conversation history for a user"""
     try:
-        history = orchestrator.conversation_history.get(user_id, [])
+        history = await orchestrator.conversation_history.get(user_id)
         
         return jsonify({
             'success': True,
@@ -373,12 +1078,10 @@ def get_conversation_history(user_id):
         }), 500
 
 @ai_bp.route('/health', methods=['GET'])
-def health_check():
+async def health_check():
     """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
-        'models_available': len(AI_MODELS),
-        'voices_available': len(VOICE_MODELS),
-        'timestamp': time.time()
-    })
+    return Response(
+        _HEALTH_PREFIX + repr(time.time()).encode() + b',"rate_limits":' + orjson.dumps(_rate_limit_status()) + b'}',
+        mimetype='application/json'
+    )
 
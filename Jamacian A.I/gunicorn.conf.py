@@ -0,0 +1,23 @@
+"""Gunicorn settings: several processes, each running the Quart app on a uvicorn event loop
+
+    gunicorn -c gunicorn.conf.py main:app
+
+Every view in the AI blueprint is async, so one worker keeps many upstream model
+calls in flight at once instead of blocking for each. Run it behind a reverse
+proxy that terminates TLS and speaks HTTP/2 to clients.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+worker_class = 'uvicorn_worker.UvicornWorker'
+# Exported so each worker's provider rate limiters (ai_models_simple.LIMITERS) take their share
+workers = int(os.environ.setdefault('WEB_CONCURRENCY', str(multiprocessing.cpu_count() * 2)))
+
+# Keep idle client connections open longer than the proxy's upstream keep-alive (60s by default)
+keepalive = 65
+
+# Async workers heartbeat from their event loop, so this only fires when the loop is blocked;
+# it does not limit how long a request or SSE stream may run
+timeout = 30
+graceful_timeout = 30
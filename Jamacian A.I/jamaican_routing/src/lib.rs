@@ -0,0 +1,122 @@
+//! Compiled query router for the AI orchestrator.
+//!
+//! Mirrors `AIOrchestrator._analyze_query` and `_select_model` in
+//! `ai_models_simple.py`. The Python side only uses this module while
+//! `keyword_table()` matches its own `TOPIC_KEYWORDS`.
+
+use std::collections::HashMap;
+use std::sync::OnceLock;
+
+use aho_corasick::AhoCorasick;
+use pyo3::prelude::*;
+
+const MUSIC_CULTURE: u8 = 1 << 0;
+const HISTORICAL: u8 = 1 << 1;
+const CREATIVE: u8 = 1 << 2;
+const EDUCATIONAL: u8 = 1 << 3;
+
+struct Topic {
+    name: &'static str,
+    flag: &'static str,
+    bit: u8,
+    keywords: &'static [&'static str],
+}
+
+const TOPICS: [Topic; 4] = [
+    Topic {
+        name: "music_culture",
+        flag: "cultural_context",
+        bit: MUSIC_CULTURE,
+        keywords: &["reggae", "jamaica", "rastafari", "bob marley", "dancehall"],
+    },
+    Topic {
+        name: "historical",
+        flag: "factual",
+        bit: HISTORICAL,
+        keywords: &["history", "when", "where", "who", "what happened"],
+    },
+    Topic {
+        name: "creative",
+        flag: "creative",
+        bit: CREATIVE,
+        keywords: &["write", "create", "compose", "lyrics", "poem", "story"],
+    },
+    Topic {
+        name: "educational",
+        flag: "factual",
+        bit: EDUCATIONAL,
+        keywords: &["explain", "how", "why", "what is", "define"],
+    },
+];
+
+/// One automaton over every keyword, plus the topic bit for each pattern id.
+fn automaton() -> &'static (AhoCorasick, Vec<u8>) {
+    static AUTOMATON: OnceLock<(AhoCorasick, Vec<u8>)> = OnceLock::new();
+    AUTOMATON.get_or_init(|| {
+        let mut patterns = Vec::new();
+        let mut bits = Vec::new();
+        for topic in TOPICS.iter() {
+            for keyword in topic.keywords {
+                patterns.push(*keyword);
+                bits.push(topic.bit);
+            }
+        }
+        let automaton = AhoCorasick::new(&patterns).expect("keyword patterns are valid");
+        (automaton, bits)
+    })
+}
+
+fn select(query: &str) -> &'static str {
+    let lower = query.to_lowercase();
+    let (automaton, bits) = automaton();
+
+    // Overlapping search so e.g. "who" inside "whole" still counts, like Python's `in`
+    let mut found = 0u8;
+    for m in automaton.find_overlapping_iter(&lower) {
+        found |= bits[m.pattern().as_usize()];
+    }
+
+    // Cultural/music queries -> Claude (music_culture is the only cultural_context source)
+    if found & MUSIC_CULTURE != 0 {
+        return "claude";
+    }
+    // Creative writing -> GPT-4
+    if found & CREATIVE != 0 {
+        return "gpt4";
+    }
+    // Factual/research queries -> Gemini
+    if found & (HISTORICAL | EDUCATIONAL) != 0 {
+        return "gemini";
+    }
+    // Complex (more than 20 words) analytical queries -> Claude
+    if query.split_whitespace().nth(20).is_some() {
+        return "claude";
+    }
+    "gpt4"
+}
+
+/// Return the model key `_select_model(_analyze_query(query))` would pick.
+#[pyfunction]
+fn analyze_and_select(query: &str) -> &'static str {
+    select(query)
+}
+
+/// The embedded keyword table as {topic: (flag, sorted keywords)}.
+#[pyfunction]
+fn keyword_table() -> HashMap<&'static str, (&'static str, Vec<&'static str>)> {
+    TOPICS
+        .iter()
+        .map(|topic| {
+            let mut keywords = topic.keywords.to_vec();
+            keywords.sort_unstable();
+            (topic.name, (topic.flag, keywords))
+        })
+        .collect()
+}
+
+#[pymodule]
+fn jamaican_routing(m: &Bound<'_, PyModule>) -> PyResult<()> {
+    m.add_function(wrap_pyfunction!(analyze_and_select, m)?)?;
+    m.add_function(wrap_pyfunction!(keyword_table, m)?)?;
+    Ok(())
+}
@@ -3,17 +3,48 @@ import sys
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory
-from flask_cors import CORS
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue
+
+import quart_flask_patch  # noqa: F401 - lets the Flask extensions below run on Quart
+import orjson
+from quart import Quart, send_from_directory
+from quart.json.provider import JSONProvider
+from quart_cors import cors
 from src.models.user import db
 from src.routes.user import user_bp
 from src.routes.ai_models_simple import ai_bp
 
-app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
+class ORJSONProvider(JSONProvider):
+    """Serialize jsonify() responses with orjson instead of the stdlib json module"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # orjson already produces bytes, so skip the str round trip dumps() would add
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
+
+# Request handlers only enqueue log records; a background thread formats and writes them
+log_queue = Queue(-1)
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+log_listener = QueueListener(log_queue, log_handler)
+logging.getLogger().addHandler(QueueHandler(log_queue))
+# INFO only for this app's own loggers; libraries such as httpx stay at the default WARNING
+logging.getLogger('src').setLevel(logging.INFO)
+
+app = Quart(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
+app.json = ORJSONProvider(app)
 
 # Enable CORS for all routes
-CORS(app, origins="*")
+app = cors(app, allow_origin="*")
 
 app.register_blueprint(user_bp, url_prefix='/api')
 app.register_blueprint(ai_bp, url_prefix='/api')
@@ -22,22 +53,32 @@ app.register_blueprint(ai_bp, url_prefix='/api')
 app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db.init_app(app)
-with app.app_context():
+
+@app.before_serving
+async def create_tables():
     db.create_all()
 
+@app.before_serving
+async def start_logging():
+    log_listener.start()
+
+@app.after_serving
+async def stop_logging():
+    log_listener.stop()
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
-def serve(path):
+async def serve(path):
     static_folder_path = app.static_folder
     if static_folder_path is None:
             return "Static folder not configured", 404
 
     if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
+        return await send_from_directory(static_folder_path, path)
     else:
         index_path = os.path.join(static_folder_path, 'index.html')
         if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
+            return await send_from_directory(static_folder_path, 'index.html')
         else:
             return "index.html not found", 404
 